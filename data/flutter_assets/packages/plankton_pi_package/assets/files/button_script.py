@@ -1,38 +1,86 @@
-from gpiozero import Button
+import lgpio
 from signal import pause
+import os
 import sys
 import json
 import time
 
+try:
+    import orjson
+    json_dumps = orjson.dumps
+except ImportError:
+    def json_dumps(data):
+        return json.dumps(data).encode()
+
+STDOUT_FD = 1
+
+# Pre-serialized responses; buttonPressed only needs its timestamp filled in
+READY_JSON = b'{"method":"ready"}\n'
+BUTTON_PRESSED_JSON = b'{"method":"buttonPressed","timestamp":%r}\n'
+
 def print_json(data):
     """Helper to print JSON and flush"""
-    print(json.dumps(data))
+    sys.stdout.buffer.write(json_dumps(data) + b"\n")
     sys.stdout.flush()
 
-button = Button(18, pull_up=True, bounce_time=0.05)
+def print_raw(line):
+    """Helper to write a pre-serialized JSON line straight to the stdout fd.
+
+    Lines are well under PIPE_BUF, so each os.write is a single atomic write.
+    """
+    os.write(STDOUT_FD, line)
+
+BUTTON_PIN = 18
+# Labels of the gpiochip wired to the 40-pin header: Pi 5 (RP1), Pi 4, and older models
+HEADER_GPIOCHIP_LABELS = ('pinctrl-rp1', 'pinctrl-bcm2711', 'pinctrl-bcm2835')
+# Kernel-side debounce: the line must be stable this long before an edge is reported
+BOUNCE_MICROS = 50000
+
+def open_header_gpiochip():
+    """Open the gpiochip that drives the 40-pin header.
+
+    That is not always gpiochip0: on a Pi 5 running a kernel before 6.6.45 it is gpiochip4,
+    so the chip is found by its label, falling back to gpiochip0 if none matches.
+    """
+    chip_numbers = sorted(int(name[8:]) for name in os.listdir('/dev')
+                          if name.startswith('gpiochip') and name[8:].isdigit())
+    for chip_number in chip_numbers:
+        try:
+            handle = lgpio.gpiochip_open(chip_number)
+        except Exception:
+            continue
+        try:
+            if lgpio.gpio_get_chip_info(handle)[3] in HEADER_GPIOCHIP_LABELS:
+                return handle
+        except Exception:
+            pass
+        lgpio.gpiochip_close(handle)
+    return lgpio.gpiochip_open(0)
+
+chip = open_header_gpiochip()
+lgpio.gpio_claim_alert(chip, BUTTON_PIN, lgpio.FALLING_EDGE, lgpio.SET_PULL_UP)
+lgpio.gpio_set_debounce_micros(chip, BUTTON_PIN, BOUNCE_MICROS)
 
 last_press_time = 0
 debounce_time = 0.3
 
-def button_callback():
+def button_callback(chip, gpio, level, timestamp):
     global last_press_time
     current_time = time.time()
     if current_time - last_press_time > debounce_time:
-        print_json({"method": "buttonPressed", "timestamp": current_time})
+        print_raw(BUTTON_PRESSED_JSON % current_time)
         last_press_time = current_time
 
-# Add both pressed handlers
-button.when_pressed = button_callback
+# Falling edge = pressed, since the input is pulled up
+button = lgpio.callback(chip, BUTTON_PIN, lgpio.FALLING_EDGE, button_callback)
 
-print_json({"method": "ready"})
+print_raw(READY_JSON)
 
 try:
-    # Add heartbeat to verify script is running
-    while True:
-        time.sleep(5)
-        # print_json({"method": "heartbeat"})
-        sys.stdout.flush()
+    # Edge events are delivered on lgpio's thread; nothing to do here until a signal arrives
+    pause()
 except KeyboardInterrupt:
     print_json({"method": "terminated"})
 finally:
-    button.close()
+    button.cancel()
+    lgpio.gpiochip_close(chip)
@@ -3,6 +3,18 @@ import time
 import json
 from gpiozero import Buzzer
 
+try:
+    import orjson
+    json_dumps = orjson.dumps
+except ImportError:
+    def json_dumps(data):
+        return json.dumps(data).encode()
+
+def print_json(data):
+    """Helper to print JSON and flush"""
+    sys.stdout.buffer.write(json_dumps(data) + b"\n")
+    sys.stdout.flush()
+
 def main():
     buzzer_pin = 16
     buzzer = Buzzer(buzzer_pin)
@@ -12,12 +24,11 @@ def main():
             buzzer.on()
             time.sleep(duration)
             buzzer.off()
-            print(json.dumps({"method": "buzzComplete"}))
+            print_json({"method": "buzzComplete"})
         except ValueError:
-            print(json.dumps({"method": "error", "message": "Invalid duration"}))
+            print_json({"method": "error", "message": "Invalid duration"})
     else:
-        print(json.dumps({"method": "error", "message": "No duration provided"}))
-    sys.stdout.flush()
+        print_json({"method": "error", "message": "No duration provided"})
 
 if __name__ == "__main__":
     main()
@@ -1,14 +1,31 @@
-import re
-import uuid
+import os
 import json
 import sys
 
+# Only the random fallback ID is cached; hardware IDs are re-derived on every run so a
+# cloned SD card never carries another board's ID
+CACHE_FILE = os.path.expanduser('~/.cache/plankton_device_id')
+
+try:
+    import orjson
+    json_dumps = orjson.dumps
+except ImportError:
+    def json_dumps(data):
+        return json.dumps(data).encode()
+
+def print_json(data):
+    """Helper to print JSON and flush"""
+    sys.stdout.buffer.write(json_dumps(data) + b"\n")
+    sys.stdout.flush()
+
 def get_cpu_serial():
     try:
-        with open('/proc/cpuinfo', 'r') as f:
-            for line in f:
-                if line.startswith('Serial'):
-                    return line.split(':')[-1].strip()
+        with open('/proc/cpuinfo', 'rb') as f:
+            data = f.read()
+        for line in data.splitlines():
+            if line.startswith(b'Serial'):
+                return line.partition(b':')[2].strip().decode()
+        return None
     except FileNotFoundError:
         return None
     except Exception as e:
@@ -25,19 +42,49 @@ def get_mac_address():
         print(f"Error reading MAC address: {e}", file=sys.stderr)
         return None
 
-def generate_device_id():
+def get_hardware_device_id():
     cpu_serial = get_cpu_serial()
-    mac_address = get_mac_address()
-
     if cpu_serial:
         return f"RPI-{cpu_serial}"
-    elif mac_address:
+    mac_address = get_mac_address()
+    if mac_address:
         return f"RPI-{mac_address.replace(':', '')}"
-    else:
-        # Fallback to a random UUID if no hardware-specific info is available
-        return f"RPI-{str(uuid.uuid4())[:8]}"
+    return None
+
+def generate_device_id():
+    device_id = get_hardware_device_id()
+    if device_id is not None:
+        return device_id
+
+    # Fallback to a random UUID if no hardware-specific info is available,
+    # kept in the cache so the ID stays stable across runs
+    device_id = load_cached_device_id()
+    if device_id is None:
+        import uuid
+        device_id = f"RPI-{uuid.uuid4().hex[:8]}"
+        save_cached_device_id(device_id)
+    return device_id
+
+def load_cached_device_id():
+    try:
+        with open(CACHE_FILE, 'r') as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        print(f"Error reading device ID cache: {e}", file=sys.stderr)
+        return None
+
+def save_cached_device_id(device_id):
+    try:
+        os.makedirs(os.path.dirname(CACHE_FILE), exist_ok=True)
+        tmp_file = CACHE_FILE + '.tmp'
+        with open(tmp_file, 'w') as f:
+            f.write(device_id)
+        os.replace(tmp_file, CACHE_FILE)
+    except Exception as e:
+        print(f"Error saving device ID cache: {e}", file=sys.stderr)
 
 if __name__ == "__main__":
     device_id = generate_device_id()
-    print(json.dumps({"method": "device_id", "id": device_id}))
-    sys.stdout.flush()
+    print_json({"method": "device_id", "id": device_id})
@@ -2,28 +2,68 @@ import sys
 import json
 import logging
 import os
-import time
+import signal
+import threading
+from concurrent.futures import ThreadPoolExecutor
 import firebase_admin
 from firebase_admin import credentials, firestore
+from firebase_admin.firestore import DELETE_FIELD
+
+try:
+    import orjson
+    json_dumps = orjson.dumps
+    json_loads = orjson.loads
+except ImportError:
+    def json_dumps(data):
+        return json.dumps(data).encode()
+    json_loads = json.loads
+
+def print_json(data):
+    """Helper to print JSON and flush"""
+    sys.stdout.buffer.write(json_dumps(data) + b"\n")
+    sys.stdout.flush()
+
+STDOUT_FD = 1
 
 # Set up logging
 log_dir = os.path.expanduser('~/plankton_logs')
 os.makedirs(log_dir, exist_ok=True)
+DEBUG_LOGGING = bool(os.environ.get('PLANKTON_DEBUG'))
 logging.basicConfig(
     filename=os.path.join(log_dir, 'firebase_listener.log'),
-    level=logging.DEBUG,
+    level=logging.DEBUG if DEBUG_LOGGING else logging.INFO,
     format='%(asctime)s - %(levelname)s - %(message)s'
 )
 
-# Also log to console
-console_handler = logging.StreamHandler()
-console_handler.setLevel(logging.DEBUG)
-logging.getLogger().addHandler(console_handler)
+# Also log to console when debugging
+if DEBUG_LOGGING:
+    console_handler = logging.StreamHandler()
+    console_handler.setLevel(logging.DEBUG)
+    logging.getLogger().addHandler(console_handler)
 
 # Global variable for device ID and Firebase credentials
 DEVICE_ID = None
 firebase_creds = None
 
+# Firestore client and device document, created once the Admin SDK is initialized
+db = None
+doc_ref = None
+
+# Single worker so actions are reported and cleared in the order they arrive
+action_executor = ThreadPoolExecutor(max_workers=1)
+
+# Latest action not yet picked up by the worker; a burst of changes collapses into it
+pending_action = None
+pending_lock = threading.Lock()
+
+# Set by the signal handlers to let the main thread exit
+shutdown_event = threading.Event()
+
+def handle_shutdown(signum, frame):
+    """Signal handler that releases the main thread so the script can exit."""
+    logging.info(f"Received signal {signum}, shutting down Firebase listener")
+    shutdown_event.set()
+
 def get_device_id():
     """Get the device ID from command-line arguments."""
     global DEVICE_ID
@@ -36,36 +76,65 @@ def get_firebase_creds():
     """Get the Firebase credentials from command-line arguments."""
     global firebase_creds
     if len(sys.argv) > 2:
-        firebase_creds = json.loads(sys.argv[2])
+        firebase_creds = json_loads(sys.argv[2])
         return firebase_creds
     logging.error("No Firebase credentials provided")
     sys.exit(1)
 
+def process_action(action):
+    """Report an action to stdout and delete it from the device document."""
+    try:
+        # Written straight to the fd, bypassing the stdout buffer, as actions are latency sensitive
+        os.write(STDOUT_FD, json_dumps({"method": "action", "action": action}) + b"\n")
+
+        doc_ref.update({'action': DELETE_FIELD})
+        logging.info("Deleted action field after processing")
+    except Exception as e:
+        logging.error(f"Error processing action {action}: {e}")
+        # Output error to stdout in JSON format
+        print_json({"status": "error", "message": str(e)})
+
+def process_pending_action():
+    """Worker task that takes the most recent pending action and processes it."""
+    global pending_action
+    with pending_lock:
+        action, pending_action = pending_action, None
+    process_action(action)
+
+def queue_action(action):
+    """Record an action, scheduling the worker only if none is already pending."""
+    global pending_action
+    with pending_lock:
+        schedule = pending_action is None
+        pending_action = action
+    if schedule:
+        action_executor.submit(process_pending_action)
+
 def handle_document_change(doc_snapshot, changes, read_time):
-    """Callback function to handle document changes in Firebase."""
+    """Callback function to handle document changes in Firebase.
+
+    Runs on the SDK's snapshot thread, so the actual work is handed off to
+    action_executor to let the listener return immediately. Actions that
+    arrive while an earlier one is still being cleared are coalesced, so a
+    burst costs one report and one DELETE_FIELD update.
+    """
     for change in changes:
         if change.type.name == 'MODIFIED':
             try:
                 data = change.document.to_dict()
                 action = data.get('action')
                 if action:
-                    logging.info(f"Detected action change: {action}")
-                    print(json.dumps({"method": "action", "action": action}))
-                    sys.stdout.flush()
-
-                    firestore.client().collection('raspiDeviceIds').document(DEVICE_ID).update({
-                        'action': firestore.DELETE_FIELD
-                    })
-                    logging.info("Deleted action field after processing")
+                    # Lazy formatting keeps the snapshot thread cheap when INFO is filtered out
+                    logging.info("Detected action change: %s", action)
+                    queue_action(action)
             except Exception as e:
                 logging.error(f"Error processing document change: {e}")
                 # Output error to stdout in JSON format
-                print(json.dumps({"status": "error", "message": str(e)}))
-                sys.stdout.flush()
+                print_json({"status": "error", "message": str(e)})
 
 def start_firebase_listener():
     """Start the Firebase listener for the device."""
-    global DEVICE_ID
+    global DEVICE_ID, db, doc_ref
     DEVICE_ID = get_device_id()
     creds = get_firebase_creds()
 
@@ -93,19 +162,19 @@ def start_firebase_listener():
         logging.info(f"Firebase listener started for device: {DEVICE_ID}")
 
         # Output 'ready' message
-        print(json.dumps({"status": "ready", "message": "Firebase listener initialized"}))
-        sys.stdout.flush()
+        print_json({"status": "ready", "message": "Firebase listener initialized"})
     except Exception as e:
         logging.error(f"Error initializing Firebase listener: {e}")
         # Output error to stdout in JSON format
-        print(json.dumps({"status": "error", "message": str(e)}))
-        sys.stdout.flush()
+        print_json({"status": "error", "message": str(e)})
         sys.exit(1)
 
 if __name__ == '__main__':
+    signal.signal(signal.SIGTERM, handle_shutdown)
+    signal.signal(signal.SIGINT, handle_shutdown)
+
     logging.info("Firebase listener script started")
     start_firebase_listener()
 
-    # Keep the script running
-    while True:
-        time.sleep(60)
+    # Keep the script running until a termination signal arrives
+    shutdown_event.wait()
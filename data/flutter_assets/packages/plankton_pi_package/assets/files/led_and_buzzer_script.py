@@ -1,8 +1,56 @@
+import os
 import sys
 import json
 import time
 from gpiozero import Buzzer
 import spidev
+import numpy as np
+
+try:
+    import orjson
+    json_dumps = orjson.dumps
+    json_loads = orjson.loads
+except ImportError:
+    def json_dumps(data):
+        return json.dumps(data).encode()
+    json_loads = json.loads
+
+# Pre-serialized responses for the messages sent on every command
+READY_JSON = b'{"method":"ready"}\n'
+EFFECT_COMPLETE_JSON = b'{"method":"effectComplete"}\n'
+BUZZ_COMPLETE_JSON = b'{"method":"buzzComplete"}\n'
+
+# Each colour byte expands to 8 SPI bytes: 0b11111100 for a 1 bit, 0b11000000 for a 0 bit.
+# The 8 bytes are viewed as one uint64 per entry so encoding gathers whole words.
+_BIT_LUT = np.where(
+    np.unpackbits(np.arange(256, dtype=np.uint8)[:, None], axis=1),
+    0b11111100,
+    0b11000000,
+).astype(np.uint8).view(np.uint64)[:, 0]
+# WS281x pixels are clocked out green first
+_GRB = [1, 0, 2]
+# Largest transfer the spidev driver accepts in one write() (its default bufsiz)
+SPIDEV_BUFSIZ = 4096
+
+# Frame periods for the animated effects, in nanoseconds
+PULSE_STEP_NS = 10_000_000
+ANIMATE_STEP_NS = 50_000_000
+
+def sleep_until(deadline_ns):
+    """Sleep only for whatever is left until a time.monotonic_ns() deadline"""
+    delay_ns = deadline_ns - time.monotonic_ns()
+    if delay_ns > 0:
+        time.sleep(delay_ns / 1_000_000_000)
+
+def print_json(data):
+    """Helper to print JSON and flush"""
+    sys.stdout.buffer.write(json_dumps(data) + b"\n")
+    sys.stdout.flush()
+
+def print_raw(line):
+    """Helper to print a pre-serialized JSON line and flush"""
+    sys.stdout.buffer.write(line)
+    sys.stdout.flush()
 
 class LedAndBuzzer:
     def __init__(self, led_spi_bus=0, led_spi_device=0, buzzer_pin=16, led_count=30, led_spi_speed=8000000):
@@ -10,67 +58,86 @@ class LedAndBuzzer:
         self.spi.open(led_spi_bus, led_spi_device)
         self.spi.max_speed_hz = led_spi_speed
         self.led_count = led_count
+        self._pixels = np.zeros((led_count, 3), dtype=np.uint8)
+        # A full frame fits in one spidev write(), so send encoded frames straight to
+        # the device fd; the speed set above still applies to plain writes
+        if led_count * 24 <= SPIDEV_BUFSIZ:
+            spi_fd = self.spi.fileno()
+            self.write_frame = lambda frame: os.write(spi_fd, frame)
+        else:
+            self.write_frame = self.spi.writebytes2
         self.buzzer = Buzzer(buzzer_pin)
 
     def hex_to_rgb(self, hex_color):
         hex_color = hex_color.lstrip('#')
         return tuple(int(hex_color[i:i+2], 16) for i in (0, 2, 4))
 
-    def encode_color_to_spi(self, r, g, b):
-        return [
-            0b11111100 if color & (1 << (7-i)) else 0b11000000
-            for color in [g, r, b]
-            for i in range(8)
-        ]
+    def encode_frame(self, pixels):
+        """Encode an (n, 3) RGB array into the SPI bit stream for the strip"""
+        # Fancy indexing a column-reordered view yields a Fortran-ordered result; os.write and
+        # writebytes2 need the words laid out pixel by pixel, so make it C-contiguous
+        return np.ascontiguousarray(_BIT_LUT[pixels[:, _GRB]])
+
+    def fill_frame(self, rgb_color):
+        """Encode a frame with every LED set to the same colour"""
+        return self.encode_frame(np.broadcast_to(np.asarray(rgb_color, dtype=np.uint8), (self.led_count, 3)))
+
+    def show(self):
+        self.write_frame(self.encode_frame(self._pixels))
 
     def update_pixels(self, colors):
-        data = []
-        for color in colors:
-            data.extend(self.encode_color_to_spi(*color))
-        self.spi.xfer2(data)
+        self._pixels[:] = colors
+        self.show()
 
     def clear_led_strip(self):
-        self.update_pixels([(0, 0, 0)] * self.led_count)
+        self._pixels[:] = 0
+        self.show()
 
     def pulse_color(self, color, duration):
-        rgb_color = self.hex_to_rgb(color)
-        start_time = time.time()
-        while time.time() - start_time < duration:
-            for i in range(0, 256, 5):
-                scaled_color = tuple(int(c * i / 255) for c in rgb_color)
-                self.update_pixels([scaled_color] * self.led_count)
-                time.sleep(0.01)
-            for i in range(255, -1, -5):
-                scaled_color = tuple(int(c * i / 255) for c in rgb_color)
-                self.update_pixels([scaled_color] * self.led_count)
-                time.sleep(0.01)
+        rgb_color = np.array(self.hex_to_rgb(color), dtype=np.uint16)
+        # Encode every brightness step of the ramp once up front
+        levels = np.concatenate((np.arange(0, 256, 5), np.arange(255, -1, -5)))
+        ramp = levels[:, None] * rgb_color // 255
+        frames = [self.fill_frame(scaled_color) for scaled_color in ramp]
+        start_time = time.monotonic()
+        next_deadline = time.monotonic_ns()
+        while time.monotonic() - start_time < duration:
+            for frame in frames:
+                self.write_frame(frame)
+                next_deadline += PULSE_STEP_NS
+                sleep_until(next_deadline)
         self.clear_led_strip()
 
     def solid_color(self, color, duration):
         rgb_color = self.hex_to_rgb(color)
-        self.update_pixels([rgb_color] * self.led_count)
+        self.update_pixels(rgb_color)
         time.sleep(duration)
         self.clear_led_strip()
 
     def flash_color(self, color, duration, flash_duration=0.5):
-        rgb_color = self.hex_to_rgb(color)
+        on_frame = self.fill_frame(self.hex_to_rgb(color))
+        off_frame = self.fill_frame((0, 0, 0))
         end_time = time.time() + duration
         while time.time() < end_time:
-            self.update_pixels([rgb_color] * self.led_count)
+            self.write_frame(on_frame)
             time.sleep(flash_duration)
-            self.clear_led_strip()
+            self.write_frame(off_frame)
             time.sleep(flash_duration)
 
     def animate_up(self, color, duration):
         rgb_color = self.hex_to_rgb(color)
-        start_time = time.time()
-        while time.time() - start_time < duration:
+        start_time = time.monotonic()
+        self._pixels[:] = 0
+        while time.monotonic() - start_time < duration:
+            next_deadline = time.monotonic_ns()
             for i in range(self.led_count):
-                pixels = [(0, 0, 0)] * self.led_count
-                pixels[i] = rgb_color
-                pixels[-(i + 1)] = rgb_color
-                self.update_pixels(pixels)
-                time.sleep(0.05)
+                # Only the two lit positions change between frames
+                lit = [i, self.led_count - 1 - i]
+                self._pixels[lit] = rgb_color
+                self.show()
+                self._pixels[lit] = 0
+                next_deadline += ANIMATE_STEP_NS
+                sleep_until(next_deadline)
             self.buzzer.on()
             time.sleep(0.1)
             self.buzzer.off()
@@ -78,14 +145,17 @@ class LedAndBuzzer:
 
     def animate_down(self, color, duration):
         rgb_color = self.hex_to_rgb(color)
-        start_time = time.time()
-        while time.time() - start_time < duration:
+        start_time = time.monotonic()
+        self._pixels[:] = 0
+        while time.monotonic() - start_time < duration:
+            next_deadline = time.monotonic_ns()
             for i in range(self.led_count // 2):
-                pixels = [(0, 0, 0)] * self.led_count
-                pixels[self.led_count // 2 - i] = rgb_color
-                pixels[self.led_count // 2 + i] = rgb_color
-                self.update_pixels(pixels)
-                time.sleep(0.05)
+                lit = [self.led_count // 2 - i, self.led_count // 2 + i]
+                self._pixels[lit] = rgb_color
+                self.show()
+                self._pixels[lit] = 0
+                next_deadline += ANIMATE_STEP_NS
+                sleep_until(next_deadline)
             self.buzzer.on()
             time.sleep(0.1)
             self.buzzer.off()
@@ -103,31 +173,28 @@ class LedAndBuzzer:
         elif mode == 'animate_down':
             self.animate_down(color, duration)
         else:
-            print(json.dumps({"method": "error", "message": f"Unknown mode: {mode}"}))
+            print_json({"method": "error", "message": f"Unknown mode: {mode}"})
 
 def main():
     led_and_buzzer = LedAndBuzzer()
-    print(json.dumps({"method": "ready"}))
-    sys.stdout.flush()
+    print_raw(READY_JSON)
 
-    for line in sys.stdin:
+    # Commands arrive as newline-delimited JSON; parse the raw bytes without a text decode
+    for line in sys.stdin.buffer:
         try:
-            data = json.loads(line)
+            data = json_loads(line)
             if data["method"] == "effect":
                 led_and_buzzer.run_effect(data["color"], data["mode"], data["duration"])
-                print(json.dumps({"method": "effectComplete"}))
+                print_raw(EFFECT_COMPLETE_JSON)
             elif data["method"] == "buzz":
                 led_and_buzzer.buzzer.on()
                 time.sleep(data["duration"])
                 led_and_buzzer.buzzer.off()
-                print(json.dumps({"method": "buzzComplete"}))
-            sys.stdout.flush()
+                print_raw(BUZZ_COMPLETE_JSON)
         except json.JSONDecodeError:
-            print(json.dumps({"method": "error", "message": "Invalid JSON"}))
-            sys.stdout.flush()
+            print_json({"method": "error", "message": "Invalid JSON"})
         except Exception as e:
-            print(json.dumps({"method": "error", "message": str(e)}))
-            sys.stdout.flush()
+            print_json({"method": "error", "message": str(e)})
 
 if __name__ == "__main__":
     main()
@@ -1,40 +1,82 @@
 import sys
+import asyncio
 import os
+import errno
 import json
 import time
 import logging
+import signal
+import socket
 import subprocess
 from pathlib import Path
 
-CACHE_FILE = os.path.expanduser('~/plankton-logs/init_cache.json')
-CACHE_VERSION = "1.0"  # Increment this when making changes to cache logic
+try:
+    import orjson
+    json_dumps = orjson.dumps
+except ImportError:
+    def json_dumps(data):
+        return json.dumps(data).encode()
+
+CACHE_DIR = os.path.expanduser('~/plankton-logs')
+LOG_DIR = os.path.expanduser('~/plankton_logs')
+CACHE_VERSION = "1.1"  # Increment this when making changes to cache logic
+CACHE_FLAGS = ('udev_rules', 'pyusb_installed')
+WARM_START_WINDOW = 60  # Seconds for which a previous initialization lets us skip the device reset
+
+# Kernel uevents for the printer carry PRODUCT=<idVendor>/<idProduct>/<bcdDevice> in hex
+NETLINK_KOBJECT_UEVENT = 15
+PRINTER_UEVENT_PRODUCT = b'PRODUCT=4b43/3830/'
+HOTPLUG_POLL_INTERVAL = 0.2  # Seconds between libusb lookups after the kernel announces the printer
+
+# usblp character devices; a competing process could hold one open on the printer
+PRINTER_LP_PREFIX = '/dev/usb/lp'
+
+# Created once here so the cache and logging code can assume they exist
+os.makedirs(CACHE_DIR, exist_ok=True)
+os.makedirs(LOG_DIR, exist_ok=True)
 
 def print_json(data):
     """Helper to print JSON and flush stdout"""
-    print(json.dumps(data))
+    sys.stdout.buffer.write(json_dumps(data) + b"\n")
     sys.stdout.flush()
 
+def cache_marker(flag):
+    """Path of the empty sentinel file recording a cached flag"""
+    return os.path.join(CACHE_DIR, f'.{flag}_ok.v{CACHE_VERSION}')
+
 def load_cache():
-    """Load the cache file if it exists"""
-    try:
-        if os.path.exists(CACHE_FILE):
-            with open(CACHE_FILE, 'r') as f:
-                cache = json.load(f)
-                if cache.get('version') == CACHE_VERSION:
-                    return cache
-    except Exception:
-        pass
-    return {'version': CACHE_VERSION, 'udev_rules': False, 'pyusb_installed': False}
+    """Load the cached flags from their marker files"""
+    cache = {'version': CACHE_VERSION}
+    for flag in CACHE_FLAGS:
+        cache[flag] = os.path.exists(cache_marker(flag))
+    return cache
 
 def save_cache(cache):
-    """Save the cache file"""
+    """Create a marker file for every flag that is set"""
     try:
-        os.makedirs(os.path.dirname(CACHE_FILE), exist_ok=True)
-        with open(CACHE_FILE, 'w') as f:
-            json.dump(cache, f)
+        for flag in CACHE_FLAGS:
+            if cache.get(flag):
+                open(cache_marker(flag), 'w').close()
     except Exception as e:
         logging.warning(f"Failed to save cache: {e}")
 
+def load_init_state():
+    """Return (timestamp, bus, address) of the last successful initialization, if recorded"""
+    try:
+        with open(cache_marker('printer_init'), 'r') as f:
+            last_init, bus, address = f.read().split()
+        return float(last_init), int(bus), int(address)
+    except Exception:
+        return None
+
+def save_init_state(device):
+    """Record when and on which bus/address the printer was last initialized"""
+    try:
+        with open(cache_marker('printer_init'), 'w') as f:
+            f.write(f"{time.time()} {device.bus} {device.address}")
+    except Exception as e:
+        logging.warning(f"Failed to save init state: {e}")
+
 def check_root_privileges():
     """Check if the script is run with root privileges"""
     if os.geteuid() != 0:
@@ -44,7 +86,15 @@ def check_root_privileges():
         })
         sys.exit(1)
 
-def setup_udev_rules(cache):
+async def run_checked(*command):
+    """Run a command on the event loop, raising CalledProcessError if it fails"""
+    # stdout is the JSON channel to the app, so the command's own output is discarded
+    proc = await asyncio.create_subprocess_exec(*command, stdout=subprocess.DEVNULL)
+    returncode = await proc.wait()
+    if returncode != 0:
+        raise subprocess.CalledProcessError(returncode, command)
+
+async def setup_udev_rules(cache):
     """Set up udev rules to allow USB device access without root privileges"""
     if cache.get('udev_rules'):
         print_json({"status": "progress", "message": "Using cached udev rules"})
@@ -64,8 +114,9 @@ def setup_udev_rules(cache):
         with open(rules_file, "w") as f:
             f.write(udev_rule)
 
-        subprocess.run(["udevadm", "control", "--reload-rules"], check=True)
-        subprocess.run(["udevadm", "trigger"], check=True)
+        # trigger must see the reloaded rules, so these run one after the other
+        await run_checked("udevadm", "control", "--reload-rules")
+        await run_checked("udevadm", "trigger")
 
         cache['udev_rules'] = True
         save_cache(cache)
@@ -93,8 +144,9 @@ def ensure_pyusb_installed(cache):
             result = subprocess.run(
                 ["apt-get", "install", "-y", "python3-usb"],
                 check=True,
-                capture_output=True,
-                text=True
+                # Nothing reads apt's output, so don't set up pipes for it
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL
             )
             if result.returncode == 0:
                 cache['pyusb_installed'] = True
@@ -106,6 +158,13 @@ def ensure_pyusb_installed(cache):
             print_json({"status": "error", "message": f"Failed to install pyusb: {str(e)}"})
             return False
 
+# pyusb's usb.util, bound by PrinterInitializer.usb when pyusb is first imported
+usb_util = None
+
+def is_out_endpoint(endpoint):
+    """find_descriptor match for the host-to-printer endpoint"""
+    return usb_util.endpoint_direction(endpoint.bEndpointAddress) == usb_util.ENDPOINT_OUT
+
 class PrinterInitializer:
     def __init__(self):
         # Load cache
@@ -114,18 +173,12 @@ class PrinterInitializer:
         # Check for root privileges before proceeding
         check_root_privileges()
 
-        # Run udev setup function to ensure USB access permissions
-        if not setup_udev_rules(self.cache):
-            sys.exit(1)
-
         # Ensure pyusb is installed before any further code executes
         if not ensure_pyusb_installed(self.cache):
             sys.exit(1)
 
-        # Now safely import usb after installation check
-        import usb.core
-        import usb.util
-        self.usb = usb
+        # pyusb is imported on first use, see the usb property
+        self._usb = None
 
         self.VENDOR_ID = 0x4b43
         self.PRODUCT_ID = 0x3830
@@ -133,14 +186,22 @@ class PrinterInitializer:
         self.RETRY_DELAY = 2
         self.setup_logging()
 
+    @property
+    def usb(self):
+        """The pyusb package, imported the first time the printer is accessed"""
+        global usb_util
+        if self._usb is None:
+            import usb.core
+            import usb.util
+            self._usb = usb
+            usb_util = usb.util
+        return self._usb
+
     def setup_logging(self):
         """Configure logging"""
         try:
-            log_dir = os.path.expanduser('~/plankton_logs')
-            os.makedirs(log_dir, exist_ok=True)
-
             logging.basicConfig(
-                filename=os.path.join(log_dir, 'printer_init.log'),
+                filename=os.path.join(LOG_DIR, 'printer_init.log'),
                 level=logging.DEBUG,
                 format='%(asctime)s - %(levelname)s - %(message)s'
             )
@@ -148,14 +209,42 @@ class PrinterInitializer:
         except Exception as e:
             print_json({"status": "error", "message": f"Failed to setup logging: {str(e)}"})
 
-    def kill_competing_processes(self):
-        """Kill any processes that might be using the printer"""
+    async def kill_competing_processes(self, device=None):
+        """Kill any processes that might be using the printer
+
+        Only /dev/usb/lp* nodes are matched, plus the raw usbfs node of device when it is
+        known; other USB devices such as the scanner or relay board are left alone.
+        """
         try:
-            subprocess.run("sudo lsof /dev/usb/lp* 2>/dev/null | awk '{print $2}' | grep -v PID | xargs -r kill -9",
-                           shell=True, stderr=subprocess.DEVNULL)
-            subprocess.run("sudo lsof /dev/bus/usb/*/* 2>/dev/null | grep USB | awk '{print $2}' | xargs -r kill -9",
-                           shell=True, stderr=subprocess.DEVNULL)
-            time.sleep(0.5)
+            own_pids = {os.getpid(), os.getppid()}
+            usbfs_node = f'/dev/bus/usb/{device.bus:03d}/{device.address:03d}' if device is not None else None
+            killed = False
+            for pid in os.listdir('/proc'):
+                if not pid.isdigit() or int(pid) in own_pids:
+                    continue
+                fd_dir = f'/proc/{pid}/fd'
+                try:
+                    fds = os.listdir(fd_dir)
+                except OSError:
+                    # Process exited or is not accessible
+                    continue
+                targets = []
+                for fd in fds:
+                    try:
+                        targets.append(os.readlink(os.path.join(fd_dir, fd)))
+                    except OSError:
+                        # This fd was closed after listdir; the others still count
+                        pass
+                if any(target.startswith(PRINTER_LP_PREFIX) or target == usbfs_node for target in targets):
+                    try:
+                        os.kill(int(pid), signal.SIGKILL)
+                        killed = True
+                        logging.info(f"Killed process {pid} holding the printer")
+                    except OSError:
+                        pass
+            if killed:
+                # Give the kernel a moment to release the killed processes' handles
+                await asyncio.sleep(0.5)
             return True
         except Exception as e:
             logging.error(f"Error killing competing processes: {e}")
@@ -166,27 +255,74 @@ class PrinterInitializer:
         try:
             for cfg in device:
                 for intf in range(cfg.bNumInterfaces):
-                    if device.is_kernel_driver_active(intf):
-                        try:
-                            device.detach_kernel_driver(intf)
-                            logging.info(f"Detached kernel driver from interface {intf}")
-                        except self.usb.core.USBError as e:
+                    # Detach without querying first; ENOENT means no kernel driver was bound
+                    try:
+                        device.detach_kernel_driver(intf)
+                        logging.info(f"Detached kernel driver from interface {intf}")
+                    except self.usb.core.USBError as e:
+                        if e.errno != errno.ENOENT:
                             sys.exit(f"Could not detach kernel driver from interface({intf}): {e}")
             return True
         except Exception as e:
             logging.error(f"Error releasing kernel driver: {e}")
             return False
 
-    def reset_device(self, device):
+    async def reset_device(self, device):
         """Reset USB device"""
         try:
-            device.reset()
-            time.sleep(0.5)
+            # libusb calls block, so keep them off the event loop
+            await asyncio.get_running_loop().run_in_executor(None, device.reset)
+            await asyncio.sleep(0.5)
             return True
         except Exception as e:
             logging.error(f"Error resetting device: {e}")
             return False
 
+    async def wait_for_printer(self, timeout):
+        """Wait for the printer to be plugged in and visible to libusb; False on timeout"""
+        try:
+            sock = socket.socket(socket.AF_NETLINK, socket.SOCK_DGRAM, NETLINK_KOBJECT_UEVENT)
+            sock.bind((0, 1))  # Multicast group 1 receives kernel uevents
+            sock.setblocking(False)
+        except OSError as e:
+            logging.warning(f"Could not listen for USB hotplug events: {e}")
+            await asyncio.sleep(self.RETRY_DELAY)
+            return False
+
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+
+        async def printer_added():
+            while True:
+                event = await loop.sock_recv(sock, 8192)
+                if event.startswith(b'add@') and PRINTER_UEVENT_PRODUCT in event:
+                    return
+
+        try:
+            print_json({"status": "progress", "message": "Waiting for printer to be connected"})
+            await asyncio.wait_for(printer_added(), timeout)
+            logging.info("Printer hotplug event received")
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            sock.close()
+
+        # The kernel uevent arrives before udevd has processed the device, and libusb's
+        # udev backend only lists the printer after that, so poll until it shows up
+        while not self.printer_present():
+            if loop.time() >= deadline:
+                logging.warning("Printer announced by the kernel but not visible to libusb")
+                return False
+            await asyncio.sleep(HOTPLUG_POLL_INTERVAL)
+        return True
+
+    def printer_present(self):
+        """Quietly check whether libusb can see the printer"""
+        try:
+            return self.usb.core.find(idVendor=self.VENDOR_ID, idProduct=self.PRODUCT_ID) is not None
+        except Exception:
+            return False
+
     def find_printer(self):
         """Locate the printer device"""
         try:
@@ -206,11 +342,12 @@ class PrinterInitializer:
             print_json({"status": "error", "message": error_msg})
             return None
 
-    def configure_printer(self, device):
-        """Configure the printer device"""
+    async def configure_printer(self, device, warm=False):
+        """Configure the printer device, skipping the reset on a warm start"""
         try:
-            self.reset_device(device)
-            self.kill_competing_processes()
+            if not warm:
+                await self.reset_device(device)
+                await self.kill_competing_processes(device)
             self.release_kernel_driver(device)
 
             try:
@@ -218,8 +355,8 @@ class PrinterInitializer:
             except self.usb.core.USBError as e:
                 if e.errno == 16:  # Resource busy
                     logging.warning("Resource busy, attempting to free...")
-                    self.kill_competing_processes()
-                    time.sleep(1)
+                    await self.kill_competing_processes(device)
+                    await asyncio.sleep(1)
                     device.set_configuration()
                 else:
                     raise
@@ -237,9 +374,7 @@ class PrinterInitializer:
             # Find output endpoint
             ep_out = self.usb.util.find_descriptor(
                 intf,
-                custom_match=lambda e:
-                self.usb.util.endpoint_direction(e.bEndpointAddress) ==
-                self.usb.util.ENDPOINT_OUT
+                custom_match=is_out_endpoint
             )
 
             if not ep_out:
@@ -271,8 +406,16 @@ class PrinterInitializer:
             print_json({"status": "error", "message": error_msg})
             return False
 
-    def initialize_printer(self):
+    async def initialize_printer(self):
         """Main printer initialization procedure"""
+        # Run udev setup function to ensure USB access permissions
+        if not await setup_udev_rules(self.cache):
+            return False
+
+        init_state = load_init_state()
+        warm = init_state is not None and time.time() - init_state[0] < WARM_START_WINDOW
+
+        waited_for_hotplug = False
         attempt = 0
         while attempt < self.MAX_RETRIES:
             try:
@@ -282,17 +425,31 @@ class PrinterInitializer:
                     "message": f"Attempting printer initialization (attempt {attempt + 1}/{self.MAX_RETRIES})"
                 })
 
-                self.kill_competing_processes()
+                if not warm:
+                    await self.kill_competing_processes()
 
                 device = self.find_printer()
                 if device is None:
+                    warm = False
+                    # Rather than polling, wait once for the printer to be plugged in
+                    if not waited_for_hotplug:
+                        waited_for_hotplug = True
+                        if await self.wait_for_printer(self.MAX_RETRIES * self.RETRY_DELAY):
+                            continue
                     attempt += 1
                     continue
 
-                if not self.configure_printer(device):
+                # Only a device still at the recorded bus/address counts as warm
+                warm = warm and (device.bus, device.address) == init_state[1:]
+                if warm:
+                    logging.info("Recently initialized printer found, skipping reset")
+
+                if not await self.configure_printer(device, warm):
+                    warm = False
                     attempt += 1
                     continue
 
+                save_init_state(device)
                 print_json({"status": "success", "message": "Printer initialized successfully"})
                 logging.info("Printer initialization completed successfully")
                 return True
@@ -300,10 +457,11 @@ class PrinterInitializer:
             except Exception as e:
                 logging.error(f"Error during initialization attempt {attempt + 1}: {e}")
                 print_json({"status": "error", "message": str(e)})
+                warm = False
 
             attempt += 1
             if attempt < self.MAX_RETRIES:
-                time.sleep(self.RETRY_DELAY)
+                await asyncio.sleep(self.RETRY_DELAY)
 
         logging.error("Printer initialization failed after all attempts")
         print_json({
@@ -315,7 +473,7 @@ class PrinterInitializer:
 def main():
     try:
         initializer = PrinterInitializer()
-        success = initializer.initialize_printer()
+        success = asyncio.run(initializer.initialize_printer())
         sys.exit(0 if success else 1)
     except KeyboardInterrupt:
         print_json({"status": "error", "message": "Initialization interrupted by user"})
@@ -1,30 +1,102 @@
 import sys
 import json
 import logging
+from logging.handlers import RotatingFileHandler
 import usb.core
 import usb.util
-import base64
-from PIL import Image, ImageOps
+import binascii
+from PIL import Image
 from io import BytesIO
 import time
 import os
+import errno
 import textwrap
-
-# Define the cache file path
-CACHE_FILE = os.path.expanduser('~/plankton-logs/printer_cache.json')
+import codecs
+import queue
+import threading
+
+try:
+    import orjson
+    json_dumps = orjson.dumps
+    json_loads = orjson.loads
+except ImportError:
+    def json_dumps(data):
+        return json.dumps(data).encode()
+    json_loads = json.loads
+
+# Present while the last printer initialization succeeded
+INIT_MARKER = os.path.expanduser('~/plankton-logs/.printer_ok')
 
 log_dir = os.path.expanduser('~/plankton_logs')
 os.makedirs(log_dir, exist_ok=True)
 
+# Tracebacks and debug messages are only logged when PLANKTON_DEBUG is set
+DEBUG_LOGGING = bool(os.environ.get('PLANKTON_DEBUG'))
+
+# Cap Print.log on the SD card; the file is only opened once something is logged
+log_handler = RotatingFileHandler(
+    os.path.join(log_dir, 'Print.log'),
+    maxBytes=1_000_000,
+    backupCount=3,
+    delay=True
+)
+
 logging.basicConfig(
-    filename=os.path.join(log_dir, 'Print.log'),
-    level=logging.DEBUG,
+    handlers=[log_handler],
+    level=logging.DEBUG if DEBUG_LOGGING else logging.INFO,
     format='%(asctime)s - %(levelname)s - %(message)s',
     force=True  # Ensure logging is configured properly
 )
 
 VENDOR_ID = 0x4b43
 PRODUCT_ID = 0x3830
+# libusb splits a write into packets itself; a whole raster image is sent as one transfer,
+# so allow for the printer pacing it while the paper feeds
+WRITE_TIMEOUT_MS = 10000
+
+# ESC/POS formatting commands, looked up per job instead of rebuilt
+ALIGN_COMMANDS = {'left': b'\x1B\x61\x00', 'center': b'\x1B\x61\x01', 'right': b'\x1B\x61\x02'}
+BOLD_COMMANDS = (b'\x1B\x45\x00', b'\x1B\x45\x01')
+UNDERLINE_COMMANDS = (b'\x1B\x2D\x00', b'\x1B\x2D\x01')
+FONT_A_COMMAND = b'\x1B\x4D\x00'
+FONT_B_COMMAND = b'\x1B\x4D\x01'
+SIZE_COMMANDS = {
+    (width, height): b'\x1D\x21' + bytes([((width - 1) << 4) | (height - 1)])
+    for width in range(1, 9) for height in range(1, 9)
+}
+
+# Grayscale to bilevel lookup for undithered images
+THRESHOLD_TABLE = [0] * 128 + [255] * 128
+
+# Printed text is GB18030; bind the encoder once rather than looking the codec up per line
+encode_gb18030 = codecs.getencoder('gb18030')
+
+STDOUT_FD = 1
+
+# Pre-encoded replies for the messages sent around every command
+READY_JSON = b'{"status": "ready"}\n'
+SUCCESS_JSON = b'{"status": "success"}\n'
+
+# Commands parsed ahead of the one being printed
+COMMAND_QUEUE_SIZE = 4
+
+def write_stdout(line):
+    """Write an encoded JSON line straight to the stdout fd, bypassing sys.stdout's buffer"""
+    view = memoryview(line)
+    while view:
+        view = view[os.write(STDOUT_FD, view):]
+
+def emit_json(data):
+    """Encode a status message and write it to stdout"""
+    write_stdout(json_dumps(data) + b'\n')
+
+def emit_error(message):
+    """Report an error status to the app"""
+    emit_json({"status": "error", "message": message})
+
+def is_out_endpoint(endpoint):
+    """find_descriptor match for the host-to-printer endpoint"""
+    return usb.util.endpoint_direction(endpoint.bEndpointAddress) == usb.util.ENDPOINT_OUT
 
 class Printer:
     def __init__(self, vendor_id, product_id, max_retries=5, retry_delay=2):
@@ -32,61 +104,48 @@ class Printer:
         self.product_id = product_id
         self.device = None
         self.ep_out = None
+        self._raw_write = None  # ep_out.write, bound once the endpoint is found
         self.max_retries = max_retries
         self.retry_delay = retry_delay
-        self.cache = self.load_cache()
         self.initialize_device()
 
-    def load_cache(self):
-        """Load the cache file if it exists"""
+    def mark_initialized(self, initialized):
+        """Create or remove the marker file recording the initialization result"""
         try:
-            if os.path.exists(CACHE_FILE):
-                with open(CACHE_FILE, 'r') as f:
-                    cache = json.load(f)
-                    logging.debug("Cache loaded successfully.")
-                    return cache
+            if initialized:
+                open(INIT_MARKER, 'w').close()
+            elif os.path.exists(INIT_MARKER):
+                os.unlink(INIT_MARKER)
         except Exception as e:
-            logging.warning(f"Failed to load cache: {e}")
-        return {}
-
-    def save_cache(self):
-        """Save the cache file"""
-        try:
-            with open(CACHE_FILE, 'w') as f:
-                json.dump(self.cache, f)
-            logging.debug("Cache saved successfully.")
-        except Exception as e:
-            logging.warning(f"Failed to save cache: {e}")
+            logging.warning(f"Failed to update init marker: {e}")
 
     def initialize_device(self):
         logging.debug("Starting printer initialization.")
         print("Initializing printer...", file=sys.stderr)
         for attempt in range(self.max_retries):
-            logging.debug(f"Attempt {attempt + 1} to initialize the printer.")
+            logging.debug("Attempt %d to initialize the printer.", attempt + 1)
             print(f"Attempt {attempt + 1} to initialize the printer.", file=sys.stderr)
             try:
                 self.device = self.find_device()
                 if self.device:
                     self.ep_out = self.find_endpoint()
                     if self.ep_out:
+                        self._raw_write = self.ep_out.write
                         logging.info("Printer initialized successfully.")
                         print("Printer initialized successfully.", file=sys.stderr)
-                        self.cache['initialized'] = True
-                        self.save_cache()
+                        self.mark_initialized(True)
                         return
             except Exception as e:
-                logging.error(f"Attempt {attempt + 1} failed: {str(e)}")
-                logging.exception(e)
+                logging.error(f"Attempt {attempt + 1} failed: {str(e)}", exc_info=DEBUG_LOGGING)
                 print(f"Attempt {attempt + 1} failed: {e}", file=sys.stderr)
             time.sleep(self.retry_delay)
         logging.error("Failed to initialize printer after multiple attempts.")
         print("Failed to initialize printer after multiple attempts.", file=sys.stderr)
-        self.cache['initialized'] = False
-        self.save_cache()
+        self.mark_initialized(False)
         raise Exception("Printer initialization failed")
 
     def find_device(self):
-        logging.debug(f"Searching for device with Vendor ID: {hex(self.vendor_id)}, Product ID: {hex(self.product_id)}")
+        logging.debug("Searching for device with Vendor ID: %#x, Product ID: %#x", self.vendor_id, self.product_id)
         device = usb.core.find(idVendor=self.vendor_id, idProduct=self.product_id)
         if device is None:
             logging.error("Printer not found. Listing all connected USB devices:")
@@ -94,80 +153,77 @@ class Printer:
             for dev in devices:
                 logging.error(f"Device: idVendor={hex(dev.idVendor)}, idProduct={hex(dev.idProduct)}")
             raise ValueError("Printer not found")
-        logging.debug(f"Printer found: idVendor={hex(device.idVendor)}, idProduct={hex(device.idProduct)}")
+        logging.debug("Printer found: idVendor=%#x, idProduct=%#x", device.idVendor, device.idProduct)
         try:
-            # Detach kernel drivers
+            # Detach kernel drivers. Detaching straight away saves a separate is_kernel_driver_active
+            # query per interface; libusb reports ENOENT when no driver was bound
             for cfg in device:
                 for intf in cfg:
-                    if device.is_kernel_driver_active(intf.bInterfaceNumber):
-                        try:
-                            device.detach_kernel_driver(intf.bInterfaceNumber)
-                            logging.debug(f"Kernel driver detached from interface {intf.bInterfaceNumber}")
-                        except usb.core.USBError as e:
+                    try:
+                        device.detach_kernel_driver(intf.bInterfaceNumber)
+                        logging.debug("Kernel driver detached from interface %s", intf.bInterfaceNumber)
+                    except usb.core.USBError as e:
+                        if e.errno != errno.ENOENT:
                             logging.error(f"Could not detach kernel driver from interface {intf.bInterfaceNumber}: {e}")
                             raise
-            # Set configuration
-            device.set_configuration()
+            # Set configuration. Re-selecting the active configuration makes libusb do a lightweight
+            # reset of the device, so only set it when the printer is still unconfigured
+            try:
+                configured = device.get_active_configuration() is not None
+            except usb.core.USBError:
+                configured = False
+            if not configured:
+                device.set_configuration()
             usb.util.claim_interface(device, 0)
         except usb.core.USBError as e:
-            logging.error(f"USBError during device setup: {e}")
-            logging.exception(e)
+            logging.error(f"USBError during device setup: {e}", exc_info=DEBUG_LOGGING)
             raise
         return device
 
     def find_endpoint(self):
         logging.debug("Finding the output endpoint.")
         cfg = self.device.get_active_configuration()
-        logging.debug(f"Active configuration: {cfg}")
+        logging.debug("Active configuration: %s", cfg)
         intf = usb.util.find_descriptor(
             cfg,
             bInterfaceNumber=0,
             bAlternateSetting=0
         )
-        logging.debug(f"Interface: {intf}")
+        logging.debug("Interface: %s", intf)
         if intf is None:
             logging.error("Interface not found.")
             raise ValueError("Interface not found")
-        endpoints = [ep.bEndpointAddress for ep in intf]
-        logging.debug(f"Endpoints available: {endpoints}")
+        if logging.getLogger().isEnabledFor(logging.DEBUG):
+            logging.debug("Endpoints available: %s", [ep.bEndpointAddress for ep in intf])
         ep_out = usb.util.find_descriptor(
             intf,
-            custom_match=lambda e: usb.util.endpoint_direction(e.bEndpointAddress) == usb.util.ENDPOINT_OUT
+            custom_match=is_out_endpoint
         )
         if ep_out is None:
             logging.error("Output endpoint not found.")
             raise ValueError("Endpoint not found")
-        logging.debug(f"Output endpoint: {ep_out}")
+        logging.debug("Output endpoint: %s", ep_out)
         return ep_out
 
     def write(self, data):
-        if not self.ep_out:
+        if self._raw_write is None:
             raise ValueError("Printer not properly initialized")
         try:
-            self.ep_out.write(data)
+            self._raw_write(data, WRITE_TIMEOUT_MS)
         except usb.core.USBError as e:
             if e.errno == 19:
                 logging.error("Device disconnected. Attempting to reconnect.")
+                # Drop the stale handle and claimed interface instead of leaking them across reconnects
+                usb.util.dispose_resources(self.device)
                 self.initialize_device()
-                if self.ep_out:
-                    self.ep_out.write(data)
+                if self._raw_write is not None:
+                    self._raw_write(data, WRITE_TIMEOUT_MS)
                 else:
                     raise Exception("Failed to reinitialize device")
             else:
-                logging.error(f"USBError during write: {e}")
-                logging.exception(e)
+                logging.error(f"USBError during write: {e}", exc_info=DEBUG_LOGGING)
                 raise
 
-def send_in_chunks(printer, data, chunk_size=1024):
-    try:
-        for i in range(0, len(data), chunk_size):
-            chunk = data[i:i + chunk_size]
-            printer.write(chunk)
-    except usb.core.USBError as e:
-        logging.error(f"USB Error during data transmission: {e}")
-        logging.exception(e)
-        raise
-
 def print_text(printer, command):
     try:
         text = command.get('text', '')
@@ -185,32 +241,29 @@ def print_text(printer, command):
         if not (1 <= font_width <= 8) or not (1 <= font_height <= 8):
             raise ValueError("fontWidth and fontHeight must be between 1 and 8")
 
-        printer.write(b'\x1B\x40')  # Initialize printer
-        alignments = {'left': 0, 'center': 1, 'right': 2}
-        printer.write(b'\x1B\x61' + bytes([alignments.get(align, 0)]))  # Alignment
-        printer.write(b'\x1B\x45' + bytes([1 if bold else 0]))  # Bold
-        printer.write(b'\x1B\x2D' + bytes([1 if underline else 0]))  # Underline
-
-        if font_type.upper() == 'B':
-            printer.write(b'\x1B\x4D\x01')  # Font B
-        else:
-            printer.write(b'\x1B\x4D\x00')  # Font A
-
-        size_byte = ((font_width - 1) << 4) | (font_height - 1)
-        printer.write(b'\x1D\x21' + bytes([size_byte]))  # Character size
+        # The printer handles ESC/POS commands in order, so the whole job goes out in one write
+        job = bytearray(b''.join([
+            b'\x1B\x40',  # Initialize printer
+            ALIGN_COMMANDS.get(align, ALIGN_COMMANDS['left']),  # Alignment
+            BOLD_COMMANDS[bool(bold)],  # Bold
+            UNDERLINE_COMMANDS[bool(underline)],  # Underline
+            FONT_B_COMMAND if font_type.upper() == 'B' else FONT_A_COMMAND,  # Font B / Font A
+            SIZE_COMMANDS[font_width, font_height],  # Character size
+        ]))
 
         # Wrap the text
         wrapped_lines = textwrap.wrap(text, width=max_line_length)
 
-        for line in wrapped_lines:
-            data = line.encode('gb18030', 'replace') + b'\n'
-            send_in_chunks(printer, data, chunk_size=1024)
+        if wrapped_lines:
+            # One encoder call for the whole text rather than one per line
+            data, _ = encode_gb18030('\n'.join(wrapped_lines) + '\n', 'replace')
+            job += data
 
-        printer.write(b'\x1B\x40')  # Reset printer settings
+        job += b'\x1B\x40'  # Reset printer settings
+        printer.write(job)
 
     except Exception as e:
-        logging.error(f"Error printing text: {e}")
-        logging.exception(e)
+        logging.error(f"Error printing text: {e}", exc_info=DEBUG_LOGGING)
         raise
 
 def print_image(printer, command):
@@ -219,58 +272,59 @@ def print_image(printer, command):
         width = command.get('width', None)
         height = command.get('height', None)
         align = command.get('align', 'center')
+        dither = command.get('dither', True)
 
         if not image_data_base64:
             raise ValueError("No image data provided")
 
-        image_data = base64.b64decode(image_data_base64)
-        image = Image.open(BytesIO(image_data)).convert('L')
+        image_data = binascii.a2b_base64(image_data_base64)
+        image = Image.open(BytesIO(image_data))
 
         # Resize image to maximum width if necessary
         max_width_pixels = 576  # Adjust based on printer's specs
+        if image.width > max_width_pixels:
+            # JPEGs are then decoded straight to grayscale at the smallest DCT scale that is still
+            # at least the print width; other formats ignore the draft request
+            image.draft('L', (max_width_pixels, image.height * max_width_pixels // image.width))
+        image = image.convert('L')
+
         if image.width > max_width_pixels:
             ratio = max_width_pixels / image.width
             new_height = int(image.height * ratio)
-            image = image.resize((max_width_pixels, new_height), Image.ANTIALIAS)
+            image = image.resize((max_width_pixels, new_height), Image.LANCZOS)
 
         if width and height:
             image = image.resize((width, height))
 
-        image = ImageOps.invert(image)
-        image = image.convert('1')
+        if dither:
+            image = image.convert('1')
+        else:
+            # Hard threshold in a single lookup pass, for logos and other line art
+            image = image.point(THRESHOLD_TABLE, mode='1')
         image_width = image.width
         image_height = image.height
         image_width_bytes = (image_width + 7) // 8
-        image_data_bytes = bytearray()
-
-        for y in range(image_height):
-            for x in range(0, image_width, 8):
-                byte = 0
-                for bit in range(8):
-                    if x + bit < image_width:
-                        pixel = image.getpixel((x + bit, y))
-                        if pixel == 0:
-                            byte |= 1 << (7 - bit)
-                image_data_bytes.append(byte)
-
-        alignments = {'left': 0, 'center': 1, 'right': 2}
-        alignment_cmd = b'\x1B\x61' + bytes([alignments.get(align, 1)])
+
+        # PIL stores mode '1' rows packed MSB first and zero-padded to a whole byte, which is
+        # the raster layout the printer expects. The bits are taken from the un-inverted image
+        # (set for white pixels), matching what inverting first and packing black pixels gave
+        image_data_bytes = image.tobytes('raw', '1')
+
+        alignment_cmd = ALIGN_COMMANDS.get(align, ALIGN_COMMANDS['center'])
         commands = [
             b'\x1B\x40',
             alignment_cmd,
             b'\x1D\x76\x30\x00',
             image_width_bytes.to_bytes(2, 'little'),
             image_height.to_bytes(2, 'little'),
+            image_data_bytes,
+            b'\n',
         ]
 
-        for cmd in commands:
-            printer.write(cmd)
-
-        send_in_chunks(printer, image_data_bytes)
-        printer.write(b'\n')
+        # Header, raster and trailing newline go out as one bulk transfer
+        printer.write(b''.join(commands))
     except Exception as e:
-        logging.error(f"Error printing image: {e}")
-        logging.exception(e)
+        logging.error(f"Error printing image: {e}", exc_info=DEBUG_LOGGING)
         raise
 
 def print_qr_code(printer, command):
@@ -282,8 +336,7 @@ def print_qr_code(printer, command):
         if not qr_data:
             raise ValueError("No QR data provided")
 
-        alignments = {'left': 0, 'center': 1, 'right': 2}
-        alignment_cmd = b'\x1B\x61' + bytes([alignments.get(align, 1)])
+        alignment_cmd = ALIGN_COMMANDS.get(align, ALIGN_COMMANDS['center'])
         commands = [
             b'\x1B\x40',
             alignment_cmd,
@@ -299,56 +352,84 @@ def print_qr_code(printer, command):
         commands.append(b'\x1D\x28\x6B' + bytes([pL, pH]) + b'\x31\x50\x30' + qr_data_bytes)
         # Print the QR code
         commands.append(b'\x1D\x28\x6B\x03\x00\x31\x51\x30')
+        commands.append(b'\n')
 
-        for cmd in commands:
-            printer.write(cmd)
-        printer.write(b'\n')
+        printer.write(b''.join(commands))
     except Exception as e:
-        logging.error(f"Error printing QR code: {e}")
-        logging.exception(e)
+        logging.error(f"Error printing QR code: {e}", exc_info=DEBUG_LOGGING)
         raise
 
 def feed_paper(printer, command):
     try:
         space = command.get('space', 1)
-        printer.write(b'\n' * space)
+        # ESC d n prints the buffer and feeds n lines in one command; n is a single byte
+        feed = b''.join(b'\x1B\x64' + bytes([min(lines, 255)]) for lines in range(space, 0, -255))
+        if feed:
+            printer.write(feed)
     except Exception as e:
-        logging.error(f"Error feeding paper: {e}")
-        logging.exception(e)
+        logging.error(f"Error feeding paper: {e}", exc_info=DEBUG_LOGGING)
         raise
 
 def cut_paper(printer):
     try:
         printer.write(b'\x1D\x56\x00')
     except Exception as e:
-        logging.error(f"Error cutting paper: {e}")
-        logging.exception(e)
+        logging.error(f"Error cutting paper: {e}", exc_info=DEBUG_LOGGING)
         raise
 
+def read_commands(commands):
+    """Parse stdin lines onto the command queue while the main loop is busy printing"""
+    try:
+        for line in sys.stdin.buffer:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                commands.put(json_loads(line))
+            except Exception as e:
+                # Reported by the main loop so replies stay in command order
+                commands.put(e)
+    finally:
+        commands.put(None)  # EOF
+
 def main():
     try:
         print("Starting main function", file=sys.stderr)
         logging.debug("Starting main function.")
         printer = Printer(VENDOR_ID, PRODUCT_ID)
         print("Printer initialized", file=sys.stderr)
+        started_at = time.monotonic()
+        jobs_processed = 0
+        commands = queue.Queue(maxsize=COMMAND_QUEUE_SIZE)
+        threading.Thread(target=read_commands, args=(commands,), daemon=True).start()
         logging.info("Entering main loop to process commands.")
         try:
-            sys.stdout.write(json.dumps({"status": "ready"}) + '\n')
-            sys.stdout.flush()
+            write_stdout(READY_JSON)
         except BrokenPipeError as e:
             logging.error(f"BrokenPipeError when writing to stdout: {e}")
             return  # Exit if stdout is not available
         while True:
             try:
-                line = sys.stdin.readline()
-                if not line:
+                command = commands.get()
+                if command is None:
                     logging.info("EOF reached on stdin. Exiting.")
                     break
-                line = line.strip()
-                if not line:
+                if isinstance(command, Exception):
+                    raise command
+                logging.debug("Received command: %s", command)
+                if command.get('ping'):
+                    # Liveness probe so the host can keep this process warm and decide when to recycle it
+                    try:
+                        emit_json({
+                            "status": "success",
+                            "uptime": round(time.monotonic() - started_at, 1),
+                            "jobs": jobs_processed
+                        })
+                    except BrokenPipeError as e:
+                        logging.error(f"BrokenPipeError when writing to stdout: {e}")
+                        break
                     continue
-                command = json.loads(line)
-                logging.debug(f"Received command: {command}")
+                jobs_processed += 1
                 try:
                     if 'text' in command:
                         print_text(printer, command)
@@ -363,37 +444,30 @@ def main():
                     else:
                         raise ValueError("Unknown command")
                     try:
-                        sys.stdout.write(json.dumps({"status": "success"}) + '\n')
-                        sys.stdout.flush()
+                        write_stdout(SUCCESS_JSON)
                     except BrokenPipeError as e:
                         logging.error(f"BrokenPipeError when writing to stdout: {e}")
                         break
                 except Exception as e:
-                    logging.error(f"Command execution error: {e}")
-                    logging.exception(e)
+                    logging.error(f"Command execution error: {e}", exc_info=DEBUG_LOGGING)
                     try:
-                        sys.stdout.write(json.dumps({"status": "error", "message": str(e)}) + '\n')
-                        sys.stdout.flush()
+                        emit_error(str(e))
                     except BrokenPipeError as e:
                         logging.error(f"BrokenPipeError when writing to stdout: {e}")
                         break
             except Exception as e:
-                logging.error(f"Unexpected error: {e}")
-                logging.exception(e)
+                logging.error(f"Unexpected error: {e}", exc_info=DEBUG_LOGGING)
                 # Optionally, send error back to Dart
                 try:
-                    sys.stdout.write(json.dumps({"status": "error", "message": str(e)}) + '\n')
-                    sys.stdout.flush()
+                    emit_error(str(e))
                 except BrokenPipeError as e:
                     logging.error(f"BrokenPipeError when writing to stdout: {e}")
                     break
     except Exception as e:
         print(f"Exception occurred in main: {e}", file=sys.stderr)
-        logging.error(f"Failed to initialize printer: {e}")
-        logging.exception(e)
+        logging.error(f"Failed to initialize printer: {e}", exc_info=DEBUG_LOGGING)
         try:
-            sys.stdout.write(json.dumps({"status": "error", "message": str(e)}) + '\n')
-            sys.stdout.flush()
+            emit_error(str(e))
         except BrokenPipeError as e:
             logging.error(f"BrokenPipeError when writing to stdout during initialization: {e}")
             pass
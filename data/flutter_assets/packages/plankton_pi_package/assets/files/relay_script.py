@@ -1,38 +1,97 @@
+import os
 import sys
 import json
 import time
-from gpiozero import OutputDevice
+
+try:
+    import lgpio
+except ImportError:
+    lgpio = None
+
+try:
+    import orjson
+    json_dumps = orjson.dumps
+except ImportError:
+    def json_dumps(data):
+        return json.dumps(data).encode()
+
+def print_json(data):
+    """Helper to print JSON and flush"""
+    sys.stdout.buffer.write(json_dumps(data) + b"\n")
+    sys.stdout.flush()
+
+# Labels of the gpiochip wired to the 40-pin header: Pi 5 (RP1), Pi 4, and older models
+HEADER_GPIOCHIP_LABELS = ('pinctrl-rp1', 'pinctrl-bcm2711', 'pinctrl-bcm2835')
+
+def open_header_gpiochip():
+    """Open the gpiochip that drives the 40-pin header.
+
+    That is not always gpiochip0: on a Pi 5 running a kernel before 6.6.45 it is gpiochip4,
+    so the chip is found by its label, falling back to gpiochip0 if none matches.
+    """
+    chip_numbers = sorted(int(name[8:]) for name in os.listdir('/dev')
+                          if name.startswith('gpiochip') and name[8:].isdigit())
+    for chip_number in chip_numbers:
+        try:
+            handle = lgpio.gpiochip_open(chip_number)
+        except Exception:
+            continue
+        try:
+            if lgpio.gpio_get_chip_info(handle)[3] in HEADER_GPIOCHIP_LABELS:
+                return handle
+        except Exception:
+            pass
+        lgpio.gpiochip_close(handle)
+    return lgpio.gpiochip_open(0)
 
 class RelayController:
     def __init__(self, relay_pins):
-        self.relays = []
-        for pin in relay_pins:
+        # The relays are claimed as one lgpio group, so a trigger switches them all in one write.
+        # Bit i of a group level is relay_pins[i]; relays are active low, so all ones is all off
+        self.relay_pins = relay_pins
+        self.all_off = (1 << len(relay_pins)) - 1
+        self.chip = None
+        if lgpio is not None:
             try:
-                self.relays.append(OutputDevice(pin, initial_value=True))
-            except Exception as e:
-                print(json.dumps({'status': 'error', 'message': f'Failed to initialize relay on pin {pin}: {str(e)}'}))
-                sys.stdout.flush()
-                sys.exit(1)
+                self.chip = open_header_gpiochip()
+                lgpio.group_claim_output(self.chip, relay_pins, [1] * len(relay_pins))
+            except Exception:
+                if self.chip is not None:
+                    lgpio.gpiochip_close(self.chip)
+                    self.chip = None
+        if self.chip is None:
+            # Without lgpio, or if the group claim fails, drive each relay through gpiozero
+            from gpiozero import OutputDevice
+            self.relays = []
+            for pin in relay_pins:
+                try:
+                    self.relays.append(OutputDevice(pin, initial_value=True))
+                except Exception as e:
+                    print_json({'status': 'error', 'message': f'Failed to initialize relay on pin {pin}: {str(e)}'})
+                    sys.exit(1)
+
+    def write_levels(self, levels):
+        """Set every relay line from the bits of levels"""
+        if self.chip is not None:
+            lgpio.group_write(self.chip, self.relay_pins[0], levels)
+        else:
+            for idx, relay in enumerate(self.relays):
+                relay.value = (levels >> idx) & 1
 
     def trigger_relays(self, channels):
         try:
-            # Activate specified relays
-            for idx, relay in enumerate(self.relays):
-                if idx in channels:
-                    relay.off()  # Relay is active low; off() activates it
-                else:
-                    relay.on()   # Deactivate other relays
+            channels = frozenset(channels)
+            # Activate specified relays by pulling their lines low, leaving the others high
+            levels = sum(1 << idx for idx in range(len(self.relay_pins)) if idx not in channels)
+            self.write_levels(levels)
             # Wait for 1 second
             time.sleep(1)
             # Reset all relays
-            for relay in self.relays:
-                relay.on()
+            self.write_levels(self.all_off)
             # Output success message
-            print(json.dumps({'status': 'success', 'method': 'triggerComplete'}))
-            sys.stdout.flush()
+            print_json({'status': 'success', 'method': 'triggerComplete'})
         except Exception as e:
-            print(json.dumps({'status': 'error', 'message': str(e)}))
-            sys.stdout.flush()
+            print_json({'status': 'error', 'message': str(e)})
 
 def main():
     # Initialize relay controller with GPIO pins (adjust pins as necessary)
@@ -40,8 +99,7 @@ def main():
     relay_controller = RelayController(relay_pins)
 
     # Output ready message
-    print(json.dumps({'status': 'ready', 'message': 'Relay controller initialized'}))
-    sys.stdout.flush()
+    print_json({'status': 'ready', 'message': 'Relay controller initialized'})
 
     # Read commands from stdin
     for line in sys.stdin:
@@ -53,11 +111,9 @@ def main():
                 relay_controller.trigger_relays(channels)
             else:
                 # Unknown method
-                print(json.dumps({'status': 'error', 'message': f'Unknown method {method}'}))
-                sys.stdout.flush()
+                print_json({'status': 'error', 'message': f'Unknown method {method}'})
         except Exception as e:
-            print(json.dumps({'status': 'error', 'message': str(e)}))
-            sys.stdout.flush()
+            print_json({'status': 'error', 'message': str(e)})
 
 if __name__ == '__main__':
     main()
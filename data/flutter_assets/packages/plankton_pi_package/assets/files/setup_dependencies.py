@@ -6,26 +6,49 @@ import json
 import signal
 from pathlib import Path
 import importlib.util
+import shutil
+
+# Line-buffered stdout: each JSON line is flushed by its trailing newline
+sys.stdout.reconfigure(line_buffering=True)
+
+# Touched by this script after each successful apt-get update; the update-success-stamp
+# hook comes from Ubuntu's update-notifier-common and is not present on Raspberry Pi OS
+APT_UPDATE_STAMP = os.path.expanduser('~/plankton-logs/.apt_update_ok')
+APT_LISTS_MAX_AGE = 24 * 60 * 60  # Seconds
+
+CLEAN_SYSTEM_SCRIPT = """
+dpkg --configure -a
+apt-get clean
+apt-get autoremove -y
+apt-get autoclean
+sync
+"""
 
 def print_json(data):
-    """Helper to print JSON and flush stdout"""
+    """Helper to print JSON to stdout"""
     print(json.dumps(data))
-    sys.stdout.flush()
 
 class DependencyInstaller:
     def __init__(self):
         self.apt_packages = [
             'python3-evdev',
             'python3-usb',
+            'python3-lgpio',
             'python3-pil',
+            'python3-numpy',
             'python3-pip',
             'python3-full',
             'python3-setuptools',
             'libglib2.0-dev',
             'python3-dev'
         ]
-        self.pip_packages = ['firebase-admin>=6.2.0', 'ping3']
+        # Import name -> pip requirement
+        self.pip_packages = {'firebase_admin': 'firebase-admin>=6.2.0', 'ping3': 'ping3'}
         self.max_attempts = 5
+        # apt-fast fetches archives over parallel connections and then hands off to apt-get
+        self.apt_installer = shutil.which('apt-fast') or 'apt-get'
+        self.installed_packages = None  # Loaded from dpkg on first use
+        self.pip_installed = {}  # find_spec results by module name
         self.retry_delay = 2
 
     def run_command(self, command, check=True, retries=3):
@@ -53,15 +76,35 @@ class DependencyInstaller:
                 continue
             raise Exception(last_error)
 
+    def run_check(self, command):
+        """Run a read-only query once; a non-zero exit is an answer, not something to retry"""
+        return subprocess.run(command, capture_output=True, text=True, check=False)
+
+    def load_installed_packages(self):
+        """Read the names of all installed packages with a single dpkg-query"""
+        try:
+            result = self.run_check(['dpkg-query', '-W', '-f', '${Package}\t${db:Status-Abbrev}\n'])
+        except Exception:
+            return set()
+        installed = set()
+        for line in result.stdout.splitlines():
+            name, _, status = line.partition('\t')
+            if status.startswith('ii'):
+                installed.add(name)
+        return installed
+
     def is_apt_package_installed(self, package):
         """Check if an apt package is already installed"""
-        result = self.run_command(['dpkg', '-s', package], check=False)
-        return result.returncode == 0
+        if self.installed_packages is None:
+            self.installed_packages = self.load_installed_packages()
+        return package in self.installed_packages
 
     def is_pip_package_installed(self, package_name):
         """Check if a pip package is already installed"""
-        package_spec = importlib.util.find_spec(package_name)
-        return package_spec is not None
+        installed = self.pip_installed.get(package_name)
+        if installed is None:
+            installed = self.pip_installed[package_name] = importlib.util.find_spec(package_name) is not None
+        return installed
 
     def install_apt_package(self, package):
         """Install a single apt package with robust error handling"""
@@ -72,7 +115,7 @@ class DependencyInstaller:
         print_json({"status": "progress", "message": f"Installing {package}..."})
         try:
             # Remove '--no-install-recommends' to allow full installation
-            cmd = ['sudo', 'apt-get', 'install', '-y', package]
+            cmd = ['apt-get', 'install', '-y', package]
             result = self.run_command(cmd, check=False)
 
             if result.returncode == 0:
@@ -80,7 +123,7 @@ class DependencyInstaller:
 
             # Clean system and retry if installation fails
             self.clean_system()
-            self.update_package_lists()
+            self.update_package_lists(force=True)
 
             # Try installing again without '--no-install-recommends'
             result = self.run_command(cmd, check=True)
@@ -90,6 +133,27 @@ class DependencyInstaller:
             print_json({"status": "error", "message": f"Failed to install {package}: {str(e)}"})
             return False
 
+    def install_apt_packages(self, packages):
+        """Install several apt packages with a single apt-get run"""
+        print_json({"status": "progress", "message": f"Installing {', '.join(packages)}..."})
+        try:
+            result = self.run_command([self.apt_installer, 'install', '-y', *packages], check=False)
+            self.installed_packages = None  # Re-read after apt has run
+            return result.returncode == 0
+        except Exception as e:
+            print_json({"status": "error", "message": f"Failed to install apt packages: {str(e)}"})
+            return False
+
+    def install_pip_packages(self, requirements):
+        """Install several pip packages with a single pip run"""
+        print_json({"status": "progress", "message": f"Installing {', '.join(requirements)}..."})
+        try:
+            self.run_command(['pip3', 'install', '--break-system-packages', *requirements])
+            return True
+        except Exception as e:
+            print_json({"status": "error", "message": f"Failed to install pip packages: {str(e)}"})
+            return False
+
     def install_ping3(self):
         """Install ping3 using pip with system packages flag"""
         if self.is_pip_package_installed("ping3"):
@@ -99,7 +163,7 @@ class DependencyInstaller:
         print_json({"status": "progress", "message": "Installing ping3..."})
         try:
             cmd = [
-                'sudo', 'pip3',
+                'pip3',
                 'install',
                 '--break-system-packages',
                 'ping3'
@@ -119,7 +183,7 @@ class DependencyInstaller:
         print_json({"status": "progress", "message": "Installing firebase-admin..."})
         try:
             cmd = [
-                'sudo', 'pip3',
+                'pip3',
                 'install',
                 '--break-system-packages',
                 'firebase-admin>=6.2.0'
@@ -130,17 +194,39 @@ class DependencyInstaller:
             print_json({"status": "error", "message": f"Failed to install firebase-admin: {str(e)}"})
             return False
 
-    def update_package_lists(self):
+    def apt_lists_fresh(self):
+        """Check whether apt-get update succeeded recently enough to reuse the package lists"""
+        try:
+            return time.time() - os.path.getmtime(APT_UPDATE_STAMP) < APT_LISTS_MAX_AGE
+        except OSError:
+            return False
+
+    def mark_apt_lists_updated(self):
+        """Record a successful apt-get update for apt_lists_fresh"""
+        try:
+            os.makedirs(os.path.dirname(APT_UPDATE_STAMP), exist_ok=True)
+            Path(APT_UPDATE_STAMP).touch()
+        except OSError:
+            # Without the stamp the next run simply updates again
+            pass
+
+    def update_package_lists(self, force=False):
         """Update package lists with error handling"""
+        if not force and self.apt_lists_fresh():
+            print_json({"status": "progress", "message": "Package lists are up to date. Skipping update."})
+            return True
+
         print_json({"status": "progress", "message": "Updating package lists..."})
         try:
-            result = self.run_command(['sudo', 'apt-get', 'update'], check=False)
+            result = self.run_command(['apt-get', 'update'], check=False)
             if result.returncode == 0:
+                self.mark_apt_lists_updated()
                 return True
 
             # Clean system if initial update fails
             self.clean_system()
-            result = self.run_command(['sudo', 'apt-get', 'update'], check=True)
+            result = self.run_command(['apt-get', 'update'], check=True)
+            self.mark_apt_lists_updated()
             return True
 
         except Exception as e:
@@ -149,18 +235,11 @@ class DependencyInstaller:
 
     def clean_system(self):
         """Clean the system state"""
-        commands = [
-            ['sudo', 'dpkg', '--configure', '-a'],
-            ['sudo', 'apt-get', 'clean'],
-            ['sudo', 'apt-get', 'autoremove', '-y'],
-            ['sudo', 'apt-get', 'autoclean'],
-            ['sudo', 'sync']
-        ]
-        for cmd in commands:
-            try:
-                self.run_command(cmd, check=False)
-            except:
-                continue
+        # One shell runs every step, each step regardless of whether the previous one failed
+        try:
+            self.run_command(['sh', '-c', CLEAN_SYSTEM_SCRIPT], check=False)
+        except:
+            pass
 
     def setup(self):
         """Main setup procedure"""
@@ -172,15 +251,34 @@ class DependencyInstaller:
             if not self.update_package_lists():
                 return False
 
+            missing = []
             for package in self.apt_packages:
-                if not self.install_apt_package(package):
-                    print_json({"status": "warning", "message": f"Continuing despite failure to install {package}."})
-
-            if not self.install_firebase():
-                print_json({"status": "warning", "message": "Continuing despite failure to install firebase-admin."})
-
-            if not self.install_ping3():
-                print_json({"status": "warning", "message": "Continuing despite failure to install ping3."})
+                if self.is_apt_package_installed(package):
+                    print_json({"status": "progress", "message": f"{package} is already installed. Skipping."})
+                else:
+                    missing.append(package)
+
+            # apt resolves and unpacks everything in one run; fall back to one package at a
+            # time so a single bad package doesn't block the rest
+            if missing and not self.install_apt_packages(missing):
+                for package in missing:
+                    if not self.install_apt_package(package):
+                        print_json({"status": "warning", "message": f"Continuing despite failure to install {package}."})
+
+            missing_pip = []
+            for module, requirement in self.pip_packages.items():
+                if self.is_pip_package_installed(module):
+                    print_json({"status": "progress", "message": f"{requirement} is already installed. Skipping."})
+                else:
+                    missing_pip.append(requirement)
+
+            # Same for pip: one resolver run for everything, then one package at a time on failure
+            if missing_pip and not self.install_pip_packages(missing_pip):
+                if not self.install_firebase():
+                    print_json({"status": "warning", "message": "Continuing despite failure to install firebase-admin."})
+
+                if not self.install_ping3():
+                    print_json({"status": "warning", "message": "Continuing despite failure to install ping3."})
 
             print_json({"status": "success", "message": "Setup completed successfully"})
             return True
@@ -1,11 +1,42 @@
+import os
 import sys
 import json
 import time
-import subprocess
+import threading
+import socket
 import psutil
-import requests
+import http.client
 from ping3 import ping
 
+try:
+    import orjson
+    json_dumps = orjson.dumps
+except ImportError:
+    def json_dumps(data):
+        return json.dumps(data).encode()
+
+STDOUT_FD = 1
+
+# Single-slot handoff from the sampling loop to stats_writer
+pending_stats = None
+pending_lock = threading.Lock()
+stats_ready = threading.Event()
+stdout_closed = threading.Event()
+
+INTERNET_CHECK_INTERVAL = 5  # Seconds between connectivity checks
+STATS_KEEPALIVE_INTERVAL = 5  # Seconds; unchanged stats are still re-sent this often
+
+# Seconds between samples of values that change slowly
+REFRESH_INTERVALS = {"memory_usage": 1, "disk_usage": 30, "ip_address": 30}
+next_refresh = dict.fromkeys(REFRESH_INTERVALS, 0)
+
+# The Pi's CPU sensor ("cpu_thermal" in psutil); kept open and re-read from offset 0 each tick
+CPU_TEMP_PATH = '/sys/class/thermal/thermal_zone0/temp'
+try:
+    cpu_temp_fd = os.open(CPU_TEMP_PATH, os.O_RDONLY)
+except OSError:
+    cpu_temp_fd = None
+
 cache = {
     "cpu_temperature": None,
     "internet_status": None,
@@ -15,9 +46,46 @@ cache = {
     "ip_address": None
 }
 
+def print_json(data):
+    """Helper to print JSON and flush"""
+    sys.stdout.buffer.write(json_dumps(data) + b"\n")
+    sys.stdout.flush()
+
+def print_raw(line):
+    """Helper to write a pre-serialized JSON line straight to the stdout fd.
+
+    Lines are well under PIPE_BUF, so each os.write is a single atomic write.
+    """
+    os.write(STDOUT_FD, line)
+
+def publish_stats(stats):
+    """Hand a stats line to the writer thread, replacing any line it hasn't sent yet"""
+    global pending_stats
+    line = json_dumps(stats) + b"\n"
+    with pending_lock:
+        pending_stats = line
+    stats_ready.set()
+
+def stats_writer():
+    """Write the latest stats line so a slow reader never stalls sampling"""
+    global pending_stats
+    while True:
+        stats_ready.wait()
+        stats_ready.clear()
+        with pending_lock:
+            line, pending_stats = pending_stats, None
+        if line is None:
+            continue
+        try:
+            print_raw(line)
+        except BrokenPipeError:
+            stdout_closed.set()
+            return
+
 def get_cpu_temperature():
     try:
-        temp = psutil.sensors_temperatures()['cpu_thermal'][0].current
+        # The sysfs value is in millidegrees Celsius
+        temp = int(os.pread(cpu_temp_fd, 16, 0)) / 1000
         return round(temp, 1)
     except:
         return None
@@ -33,20 +101,32 @@ def check_internet():
         if latency > 500:  # 200ms threshold for poor connection
             return False
 
-        # Second check: HTTP request with timeout
+        # Second check: HTTP request with timeout. A HEAD needs no body, and http.client
+        # skips the session and adapter setup requests does for every call
         start_time = time.time()
-        response = requests.get("http://www.google.com", timeout=3)
+        conn = http.client.HTTPConnection("www.google.com", timeout=3)
+        try:
+            conn.request("HEAD", "/")
+            conn.getresponse()
+        finally:
+            conn.close()
         response_time = time.time() - start_time
 
         if response_time > 2:
             return False
 
         return True
-    except (requests.ConnectionError, requests.Timeout):
+    except (OSError, http.client.HTTPException):
         return False
     except Exception:
         return False
 
+def internet_worker():
+    # The ping and HTTP checks can take seconds, so they run here instead of in the stats loop
+    while True:
+        cache["internet_status"] = check_internet()
+        time.sleep(INTERNET_CHECK_INTERVAL)
+
 def get_memory_usage():
     memory = psutil.virtual_memory()
     return {
@@ -56,7 +136,8 @@ def get_memory_usage():
     }
 
 def get_cpu_usage():
-    return psutil.cpu_percent(interval=0.5)
+    # Non-blocking: usage since the previous call, i.e. over the last tick
+    return psutil.cpu_percent(interval=None)
 
 def get_disk_usage():
     disk = psutil.disk_usage('/')
@@ -68,25 +149,43 @@ def get_disk_usage():
     }
 
 def get_ip_address():
+    # Same addresses `hostname -I` prints (no loopback or IPv6 link-local), without forking it
     try:
-        ip = subprocess.check_output(['hostname', '-I']).decode('utf-8').strip()
-        return ip
+        ips = []
+        for iface, addrs in psutil.net_if_addrs().items():
+            if iface == 'lo':
+                continue
+            for addr in addrs:
+                if addr.family == socket.AF_INET:
+                    ips.append(addr.address)
+                elif addr.family == socket.AF_INET6 and not addr.address.startswith('fe80'):
+                    ips.append(addr.address)
+        return ' '.join(ips) or None
     except:
         return None
 
 def update_cache():
     cache["cpu_temperature"] = get_cpu_temperature() or cache["cpu_temperature"]
-    cache["internet_status"] = check_internet()
-    cache["memory_usage"] = get_memory_usage() or cache["memory_usage"]
     cache["cpu_usage"] = get_cpu_usage() or cache["cpu_usage"]
-    cache["disk_usage"] = get_disk_usage() or cache["disk_usage"]
-    cache["ip_address"] = get_ip_address() or cache["ip_address"]
+    now = time.monotonic()
+    for key, sample in (
+        ("memory_usage", get_memory_usage),
+        ("disk_usage", get_disk_usage),
+        ("ip_address", get_ip_address),
+    ):
+        if now >= next_refresh[key]:
+            cache[key] = sample() or cache[key]
+            next_refresh[key] = now + REFRESH_INTERVALS[key]
 
 def main():
-    print(json.dumps({"method": "ready"}))
-    sys.stdout.flush()
+    psutil.cpu_percent(interval=None)  # Prime the counters so the first tick has a baseline
+    threading.Thread(target=internet_worker, daemon=True).start()
+    print_json({"method": "ready"})
+    threading.Thread(target=stats_writer, daemon=True).start()
 
-    while True:
+    last_stats = None
+    last_sent = 0
+    while not stdout_closed.is_set():
         update_cache()
         stats = {
             "method": "stats",
@@ -97,8 +196,12 @@ def main():
             "diskUsage": cache["disk_usage"],
             "ipAddress": cache["ip_address"]
         }
-        print(json.dumps(stats))
-        sys.stdout.flush()
+        # Only send when something changed, plus a periodic copy so the app knows we're alive
+        now = time.monotonic()
+        if stats != last_stats or now - last_sent >= STATS_KEEPALIVE_INTERVAL:
+            publish_stats(stats)
+            last_stats = stats
+            last_sent = now
         time.sleep(0.5)  # 500 ms interval
 
 if __name__ == "__main__":